@@ -6,9 +6,9 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import sqlite3
 import os
 import sys
+import copy
 from datetime import datetime
 import time
 
@@ -25,8 +25,15 @@ from scraping.infocasas_scraper import InfocasasScraper
 from scraping.data_processor import DataProcessor
 from machine_learning.investment_model import InvestmentModel
 from machine_learning.optimizer import InvestmentOptimizer
+from scraping.database import get_conn, set_connection_store
 from config.settings import *
 
+# Una conexión SQLite por sesión (sobrevive a los reruns, que cambian de hilo)
+set_connection_store(st.session_state)
+
+# Opciones fijas del selector de barrio (se construyen una sola vez)
+BARRIO_OPTIONS = ("Todos",) + BARRIOS_MONTEVIDEO
+
 # CSS personalizado
 st.markdown("""
 <style>
@@ -87,14 +94,124 @@ def main():
     elif page == "📈 Estadísticas":
         show_statistics()
 
+def get_db_mtime():
+    """Huella de la base de datos para invalidar el cache cuando cambia"""
+    # En modo WAL las escrituras recientes viven en el archivo -wal
+    mtimes = [
+        os.path.getmtime(path)
+        for path in (DATABASE_PATH, f"{DATABASE_PATH}-wal")
+        if os.path.exists(path)
+    ]
+    return max(mtimes) if mtimes else None
+
+@st.cache_data(ttl=300, show_spinner=False)
+def count_properties(db_path, db_mtime):
+    """Cuenta las propiedades guardadas (cacheado por ruta y mtime)"""
+    conn = get_conn(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM propiedades").fetchone()[0]
+    return count
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_properties(db_path, db_mtime):
+    """Lee la tabla de propiedades (cacheado por ruta y mtime)"""
+    conn = get_conn(db_path)
+    df = pd.read_sql_query(
+        """
+        SELECT barrio, tipo_operacion, precio, metros_cuadrados,
+               precio_por_m2, dormitorios, baños
+        FROM propiedades
+        """,
+        conn,
+        dtype=NUMERIC_DTYPES
+    )
+    
+    # Códigos enteros en lugar de strings para groupby/value_counts
+    df['barrio'] = df['barrio'].astype('category')
+    df['tipo_operacion'] = df['tipo_operacion'].astype('category')
+    return df
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_summary_counts(db_path, db_mtime):
+    """Totales por tipo de operación y cantidad de barrios, agregados en SQLite"""
+    conn = get_conn(db_path)
+    total, venta, alquiler, barrios = conn.execute(
+        """
+        SELECT COUNT(*),
+               COALESCE(SUM(tipo_operacion = ?), 0),
+               COALESCE(SUM(tipo_operacion = ?), 0),
+               COUNT(DISTINCT barrio)
+        FROM propiedades
+        """,
+        ('venta', 'alquiler')
+    ).fetchone()
+    return {'total': total, 'venta': venta, 'alquiler': alquiler, 'barrios': barrios}
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_price_stats(db_path, db_mtime):
+    """Estadísticas globales de precio y tamaño, agregadas en SQLite"""
+    conn = get_conn(db_path)
+    precio_min, precio_max, precio_mean, ppm2_mean, m2_mean = conn.execute(
+        """
+        SELECT MIN(precio), MAX(precio), AVG(precio),
+               AVG(precio_por_m2), AVG(metros_cuadrados)
+        FROM propiedades
+        """
+    ).fetchone()
+    return {
+        'precio_min': precio_min,
+        'precio_max': precio_max,
+        'precio_mean': precio_mean,
+        'precio_por_m2_mean': ppm2_mean,
+        'metros_cuadrados_mean': m2_mean
+    }
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_barrio_counts(db_path, db_mtime, limit=10):
+    """Barrios con más propiedades"""
+    conn = get_conn(db_path)
+    rows = conn.execute(
+        """
+        SELECT barrio, COUNT(*) AS cantidad
+        FROM propiedades
+        WHERE barrio IS NOT NULL
+        GROUP BY barrio
+        ORDER BY cantidad DESC
+        LIMIT ?
+        """,
+        (limit,)
+    ).fetchall()
+    return pd.DataFrame(rows, columns=['barrio', 'cantidad'])
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_avg_precio_barrio_op(db_path, db_mtime):
+    """Precio promedio por barrio y tipo de operación"""
+    conn = get_conn(db_path)
+    rows = conn.execute(
+        """
+        SELECT barrio, tipo_operacion, AVG(precio) AS precio
+        FROM propiedades
+        WHERE barrio IS NOT NULL AND tipo_operacion IS NOT NULL
+        GROUP BY barrio, tipo_operacion
+        """
+    ).fetchall()
+    return pd.DataFrame(rows, columns=['barrio', 'tipo_operacion', 'precio'])
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_prices(db_path, db_mtime):
+    """Lee solo la columna de precios (para histogramas y mediana)"""
+    conn = get_conn(db_path)
+    df = pd.read_sql_query(
+        "SELECT precio FROM propiedades WHERE precio IS NOT NULL",
+        conn,
+        dtype={'precio': 'float32'}
+    )
+    return df
+
 def check_data_exists():
     """Verifica si existen datos en la base de datos"""
     try:
         if os.path.exists(DATABASE_PATH):
-            conn = sqlite3.connect(DATABASE_PATH)
-            df = pd.read_sql_query("SELECT COUNT(*) as count FROM propiedades", conn)
-            conn.close()
-            return df['count'].iloc[0] > 0
+            return count_properties(DATABASE_PATH, get_db_mtime()) > 0
         return False
     except:
         return False
@@ -102,13 +219,62 @@ def check_data_exists():
 def load_data():
     """Carga datos desde la base de datos"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        df = pd.read_sql_query("SELECT * FROM propiedades", conn)
-        conn.close()
-        return df
+        return load_properties(DATABASE_PATH, get_db_mtime())
     except:
         return None
 
+@st.cache_data(ttl=300, show_spinner=False)
+def fig_barrio_counts(db_path, db_mtime):
+    """Gráfico de propiedades por barrio (top 10)"""
+    barrio_counts = get_barrio_counts(db_path, db_mtime, limit=10)
+    fig = px.bar(x=barrio_counts['cantidad'], y=barrio_counts['barrio'], orientation='h')
+    fig.update_layout(height=400)
+    return fig
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fig_price_histogram(db_path, db_mtime):
+    """Histograma de precios"""
+    prices = get_prices(db_path, db_mtime)
+    fig = px.histogram(prices, x='precio', nbins=30, title="Distribución de Precios")
+    fig.update_layout(height=400)
+    return fig
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fig_avg_precio_barrio(db_path, db_mtime):
+    """Gráfico de precio promedio por barrio y tipo de operación"""
+    precio_por_barrio = get_avg_precio_barrio_op(db_path, db_mtime)
+    fig = px.bar(precio_por_barrio, x='barrio', y='precio', color='tipo_operacion',
+                 title="Precio Promedio por Barrio y Tipo de Operación")
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def get_optimizer(db_mtime, roi_mtime):
+    """Optimizador con datos cargados, compartido entre sesiones"""
+    optimizer = InvestmentOptimizer()
+    if not optimizer.load_data():
+        return None
+    return optimizer
+
+def get_session_optimizer():
+    """Optimizador de la sesión actual (reutiliza los datos ya cargados)"""
+    roi_mtime = os.path.getmtime(ROI_PATH) if os.path.exists(ROI_PATH) else None
+    data_key = (get_db_mtime(), roi_mtime)
+    
+    if st.session_state.get('optimizer_key') != data_key:
+        st.session_state.pop('optimizer', None)
+    
+    if 'optimizer' not in st.session_state:
+        shared = get_optimizer(*data_key)
+        if shared is None:
+            return None
+        # Copia superficial: comparte los DataFrames de solo lectura pero
+        # cada sesión guarda sus propios scores
+        st.session_state.optimizer = copy.copy(shared)
+        st.session_state.optimizer.score_cache = {}  # cache de scores propio de la sesión
+        st.session_state.optimizer_key = data_key
+    return st.session_state.optimizer
+
 def show_dashboard():
     """Muestra el dashboard principal"""
     st.header("📋 Dashboard Principal")
@@ -117,25 +283,23 @@ def show_dashboard():
         st.warning("⚠️ No hay datos disponibles. Ve a 'Hacer Scraping' para obtener datos.")
         return
     
-    df = load_data()
+    db_mtime = get_db_mtime()
+    counts = get_summary_counts(DATABASE_PATH, db_mtime)
     
     # Métricas principales
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.metric("📊 Total Propiedades", len(df))
+        st.metric("📊 Total Propiedades", counts['total'])
     
     with col2:
-        venta_count = len(df[df['tipo_operacion'] == 'venta'])
-        st.metric("🏪 En Venta", venta_count)
+        st.metric("🏪 En Venta", counts['venta'])
     
     with col3:
-        alquiler_count = len(df[df['tipo_operacion'] == 'alquiler'])
-        st.metric("🏠 En Alquiler", alquiler_count)
+        st.metric("🏠 En Alquiler", counts['alquiler'])
     
     with col4:
-        barrios_count = df['barrio'].nunique()
-        st.metric("🗺️ Barrios", barrios_count)
+        st.metric("🗺️ Barrios", counts['barrios'])
     
     st.divider()
     
@@ -144,25 +308,15 @@ def show_dashboard():
     
     with col1:
         st.subheader("📊 Propiedades por Barrio")
-        barrio_counts = df['barrio'].value_counts().head(10)
-        fig = px.bar(x=barrio_counts.values, y=barrio_counts.index, orientation='h')
-        fig.update_layout(height=400)
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig_barrio_counts(DATABASE_PATH, db_mtime), use_container_width=True)
     
     with col2:
         st.subheader("💰 Distribución de Precios")
-        fig = px.histogram(df, x='precio', nbins=30, title="Distribución de Precios")
-        fig.update_layout(height=400)
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig_price_histogram(DATABASE_PATH, db_mtime), use_container_width=True)
     
     # Mapa de calor de precios por barrio
     st.subheader("🗺️ Precio Promedio por Barrio")
-    precio_por_barrio = df.groupby(['barrio', 'tipo_operacion'])['precio'].mean().reset_index()
-    
-    fig = px.bar(precio_por_barrio, x='barrio', y='precio', color='tipo_operacion',
-                 title="Precio Promedio por Barrio y Tipo de Operación")
-    fig.update_xaxes(tickangle=45)
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(fig_avg_precio_barrio(DATABASE_PATH, db_mtime), use_container_width=True)
 
 def show_scraping_page():
     """Página para ejecutar scraping"""
@@ -198,17 +352,13 @@ def show_scraping_page():
             total_steps = (include_venta + include_alquiler) * max_pages + 1
             current_step = 0
             
-            if include_venta:
-                status_text.text("🏪 Scrapeando propiedades en venta...")
-                scraper.scrape_properties("venta", max_pages)
-                current_step += max_pages
-                progress_bar.progress(current_step / total_steps)
+            operation_types = [op for op, include in (("venta", include_venta), ("alquiler", include_alquiler)) if include]
+            status_text.text(f"🔍 Scrapeando propiedades en {' y '.join(operation_types)}...")
             
-            if include_alquiler:
-                status_text.text("🏠 Scrapeando propiedades en alquiler...")
-                scraper.scrape_properties("alquiler", max_pages)
+            for operation_type in scraper.scrape_operations(operation_types, max_pages):
                 current_step += max_pages
                 progress_bar.progress(current_step / total_steps)
+                status_text.text(f"✔️ {operation_type} completado")
             
             status_text.text("💾 Guardando datos...")
             scraper.save_to_database()
@@ -216,7 +366,7 @@ def show_scraping_page():
             
             scraper.close()
             
-            st.success(f"✅ Scraping completado! Se obtuvieron {len(scraper.data)} propiedades")
+            st.success(f"✅ Scraping completado! Se obtuvieron {scraper.property_count()} propiedades")
             st.balloons()
             
         except Exception as e:
@@ -241,7 +391,7 @@ def show_market_analysis():
     
     # Cargar datos procesados si existen
     try:
-        roi_df = pd.read_csv('data/processed/roi_por_barrio.csv')
+        roi_df = pd.read_parquet(ROI_PATH)
         
         st.subheader("🏆 TOP 10 Barrios por ROI")
         
@@ -285,14 +435,18 @@ def show_investment_finder():
         )
     
     with col3:
-        location_pref = st.selectbox("Barrio Preferido (Opcional)", ["Todos"] + BARRIOS_MONTEVIDEO)
+        location_pref = st.selectbox("Barrio Preferido (Opcional)", BARRIO_OPTIONS)
         location = None if location_pref == "Todos" else location_pref
     
+    if st.button("♻️ Recargar datos"):
+        st.session_state.pop('optimizer', None)
+        get_optimizer.clear()
+    
     if st.button("🔍 Buscar Oportunidades", type="primary"):
         with st.spinner("Analizando oportunidades..."):
             try:
-                optimizer = InvestmentOptimizer()
-                if optimizer.load_data():
+                optimizer = get_session_optimizer()
+                if optimizer is not None:
                     results = optimizer.get_investment_recommendation(
                         budget_min, budget_max, risk_tolerance, location
                     )
@@ -338,6 +492,10 @@ def show_ml_page():
     
     st.write("Entrena y evalúa el modelo predictivo de precios")
     
+    if st.button("♻️ Recargar datos"):
+        st.session_state.pop('model', None)
+        st.session_state.pop('model_results', None)
+    
     if st.button("🚀 Entrenar Modelo", type="primary"):
         with st.spinner("Entrenando modelo..."):
             try:
@@ -346,18 +504,25 @@ def show_ml_page():
                     score = model.train_model()
                     importance_df = model.analyze_feature_importance()
                     
-                    st.success(f"✅ Modelo entrenado exitosamente (R² = {score:.4f})")
+                    # Guardar el modelo entrenado para los siguientes reruns
+                    st.session_state.model = model
+                    st.session_state.model_results = (score, importance_df)
                     
-                    if importance_df is not None:
-                        st.subheader("📊 Importancia de Características")
-                        fig = px.bar(importance_df.head(10), x='importance', y='feature', orientation='h')
-                        st.plotly_chart(fig, use_container_width=True)
-                        
                 else:
                     st.error("Error cargando datos procesados")
                     
             except Exception as e:
                 st.error(f"Error entrenando modelo: {str(e)}")
+    
+    if 'model' in st.session_state:
+        score, importance_df = st.session_state.model_results
+        
+        st.success(f"✅ Modelo entrenado exitosamente (R² = {score:.4f})")
+        
+        if importance_df is not None:
+            st.subheader("📊 Importancia de Características")
+            fig = px.bar(importance_df.head(10), x='importance', y='feature', orientation='h')
+            st.plotly_chart(fig, use_container_width=True)
 
 def show_statistics():
     """Estadísticas generales"""
@@ -367,6 +532,9 @@ def show_statistics():
         st.warning("⚠️ No hay datos disponibles.")
         return
     
+    db_mtime = get_db_mtime()
+    counts = get_summary_counts(DATABASE_PATH, db_mtime)
+    stats = get_price_stats(DATABASE_PATH, db_mtime)
     df = load_data()
     
     # Estadísticas básicas
@@ -374,18 +542,23 @@ def show_statistics():
     
     with col1:
         st.subheader("📊 Resumen General")
-        st.write(f"**Total propiedades:** {len(df):,}")
-        st.write(f"**Propiedades en venta:** {len(df[df['tipo_operacion'] == 'venta']):,}")
-        st.write(f"**Propiedades en alquiler:** {len(df[df['tipo_operacion'] == 'alquiler']):,}")
-        st.write(f"**Barrios únicos:** {df['barrio'].nunique()}")
-        st.write(f"**Rango de precios:** USD {df['precio'].min():,.0f} - {df['precio'].max():,.0f}")
+        st.write(f"**Total propiedades:** {counts['total']:,}")
+        st.write(f"**Propiedades en venta:** {counts['venta']:,}")
+        st.write(f"**Propiedades en alquiler:** {counts['alquiler']:,}")
+        st.write(f"**Barrios únicos:** {counts['barrios']}")
+        # MIN/MAX/AVG devuelven NULL si la columna no tiene valores
+        if stats['precio_min'] is not None:
+            st.write(f"**Rango de precios:** USD {stats['precio_min']:,.0f} - {stats['precio_max']:,.0f}")
     
     with col2:
         st.subheader("💰 Estadísticas de Precios")
-        st.write(f"**Precio promedio:** USD {df['precio'].mean():,.0f}")
+        if stats['precio_mean'] is not None:
+            st.write(f"**Precio promedio:** USD {stats['precio_mean']:,.0f}")
         st.write(f"**Precio mediano:** USD {df['precio'].median():,.0f}")
-        st.write(f"**Precio/m² promedio:** USD {df['precio_por_m2'].mean():,.0f}")
-        st.write(f"**Tamaño promedio:** {df['metros_cuadrados'].mean():.0f} m²")
+        if stats['precio_por_m2_mean'] is not None:
+            st.write(f"**Precio/m² promedio:** USD {stats['precio_por_m2_mean']:,.0f}")
+        if stats['metros_cuadrados_mean'] is not None:
+            st.write(f"**Tamaño promedio:** {stats['metros_cuadrados_mean']:.0f} m²")
     
     # Distribuciones
     st.subheader("📊 Distribuciones")
@@ -2,6 +2,8 @@
 Configuración del proyecto de scraping inmobiliario
 """
 
+import sys
+
 # URLs base
 BASE_URL = "https://infocasas.com.uy"
 VENTA_URL = f"{BASE_URL}/venta/apartamento/montevideo"
@@ -11,17 +13,37 @@ ALQUILER_URL = f"{BASE_URL}/alquiler/apartamento/montevideo"
 DELAY_BETWEEN_REQUESTS = 2  # segundos
 MAX_PAGES_TO_SCRAPE = 50
 TIMEOUT = 10
+SCRAPER_WORKERS = 4  # navegadores headless en paralelo
 
-# Barrios de Montevideo a analizar
-BARRIOS_MONTEVIDEO = [
+# Barrios de Montevideo a analizar (tupla inmutable de strings internados)
+BARRIOS_MONTEVIDEO = tuple(sys.intern(barrio) for barrio in (
     "Pocitos", "Punta Carretas", "Cordón", "Centro", "Ciudad Vieja",
     "Parque Rodó", "Buceo", "Malvín", "Carrasco", "Tres Cruces",
     "La Blanqueada", "Villa Biarritz", "Punta Gorda", "Palermo",
     "Barrio Sur", "Aguada", "Reducto", "Brazo Oriental", "Villa Dolores"
-]
+))
+BARRIOS_SET = frozenset(BARRIOS_MONTEVIDEO)  # para validaciones O(1)
 
 # Configuración de base de datos
 DATABASE_PATH = "data/inmobiliaria.db"
+INSERT_BATCH_SIZE = 10000  # filas por lote de executemany
+
+# Datos procesados (Parquet; CSV comprimido solo para el ROI)
+PROCESSED_PARQUET_PATH = "data/processed/propiedades_limpias.parquet"
+PROCESSED_FINGERPRINT_PATH = "data/processed/propiedades_limpias.json"  # huella de la base usada
+VENTA_METRICS_PATH = "data/processed/metricas_venta_por_barrio.parquet"
+ALQUILER_METRICS_PATH = "data/processed/metricas_alquiler_por_barrio.parquet"
+ROI_PATH = "data/processed/roi_por_barrio.parquet"
+ROI_CSV_PATH = "data/processed/roi_por_barrio.csv.gz"  # para abrir en una planilla
+
+# Tipos numéricos para análisis y ML (float32 alcanza para precios y m²)
+NUMERIC_DTYPES = {
+    'precio': 'float32',
+    'metros_cuadrados': 'float32',
+    'precio_por_m2': 'float32',
+    'dormitorios': 'float32',
+    'baños': 'float32'
+}
 
 # Configuración ML
 TEST_SIZE = 0.2
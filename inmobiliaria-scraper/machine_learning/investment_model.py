@@ -4,52 +4,96 @@ Modelo de Machine Learning para optimización de inversiones inmobiliarias
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
+from sklearn.inspection import permutation_importance
 import joblib
+from joblib import Parallel, delayed
 import sys
 import os
 
 # Agregar el directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import *
+from scraping.data_processor import load_cleaned
+
+def fit_and_score(name, model, X_train, y_train, X_test, y_test):
+    """Entrena un modelo y devuelve sus métricas sobre el conjunto de test"""
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    
+    r2 = r2_score(y_test, y_pred)
+    mae = mean_absolute_error(y_test, y_pred)
+    rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+    
+    return name, model, r2, mae, rmse
+
+# Columnas de los datos procesados que usa el modelo
+MODEL_COLUMNS = [
+    'barrio', 'tipo_operacion', 'precio', 'metros_cuadrados',
+    'precio_por_m2', 'dormitorios', 'baños'
+]
+
+def safe_ratio(numerator, denominator):
+    """
+    Divide elemento a elemento; 0 donde el denominador es 0 o negativo
+    
+    Donde el denominador es NaN (dato faltante) el resultado queda NaN.
+    """
+    out = np.zeros(len(denominator), dtype=np.float32)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    out[np.isnan(denominator)] = np.nan
+    return out
 
 class InvestmentModel:
     def __init__(self):
         self.model = None
-        self.scaler = StandardScaler()
+        self.scaler = StandardScaler(with_mean=False)  # compatible con matrices dispersas
         self.feature_columns = None
+        self.hist_feature_columns = None
+        self.best_model_name = None
+        self.feature_encoding = None  # 'one_hot' (RF/LR) o 'codes' (HistGB)
+        self.feature_importances = None
         self.target_column = 'precio_por_m2'
         
     def load_processed_data(self):
         """Carga datos procesados"""
         try:
-            self.df = pd.read_csv('data/processed/propiedades_limpias.csv')
+            # Mismo DataFrame cacheado que usa el procesador (astype devuelve una copia)
+            cleaned = load_cleaned(PROCESSED_PARQUET_PATH, os.path.getmtime(PROCESSED_PARQUET_PATH))
+            self.df = cleaned[MODEL_COLUMNS].astype(NUMERIC_DTYPES)
             print(f"Datos cargados: {len(self.df)} registros")
             return True
         except FileNotFoundError:
             print("Error: Primero debe ejecutar el procesador de datos")
             return False
     
-    def prepare_features(self):
-        """Prepara características para el modelo"""
-        # Crear DataFrame para ML
-        ml_df = self.df.copy()
+    def prepare_features(self, df=None):
+        """
+        Prepara características para el modelo
         
-        # Encoding de variables categóricas
-        ml_df = pd.get_dummies(ml_df, columns=['barrio', 'tipo_operacion'], prefix=['barrio', 'operacion'])
+        Devuelve el DataFrame con las features numéricas y la matriz dispersa
+        (CSR) con esas features más el one-hot de barrio y tipo de operación.
+        Por defecto usa self.df; df permite preparar otras filas (predicción).
+        """
+        # Crear DataFrame para ML
+        ml_df = (self.df if df is None else df).copy()
         
-        # Rellenar valores faltantes
-        ml_df['dormitorios'] = ml_df['dormitorios'].fillna(ml_df['dormitorios'].median())
-        ml_df['baños'] = ml_df['baños'].fillna(ml_df['baños'].median())
+        # Rellenar valores faltantes (medianas calculadas una sola vez)
+        dormitorios_median = ml_df['dormitorios'].median()
+        banos_median = ml_df['baños'].median()
+        ml_df['dormitorios'] = ml_df['dormitorios'].fillna(dormitorios_median)
+        ml_df['baños'] = ml_df['baños'].fillna(banos_median)
         
-        # Crear features adicionales
-        ml_df['ratio_precio_dormitorios'] = ml_df['precio'] / ml_df['dormitorios']
-        ml_df['ratio_m2_dormitorios'] = ml_df['metros_cuadrados'] / ml_df['dormitorios']
-        ml_df['ratio_baño_dormitorios'] = ml_df['baños'] / ml_df['dormitorios']
+        # Crear features adicionales (0 para monoambientes, sin inf/NaN)
+        dormitorios = ml_df['dormitorios'].to_numpy()
+        ml_df['ratio_precio_dormitorios'] = safe_ratio(ml_df['precio'].to_numpy(), dormitorios)
+        ml_df['ratio_m2_dormitorios'] = safe_ratio(ml_df['metros_cuadrados'].to_numpy(), dormitorios)
+        ml_df['ratio_baño_dormitorios'] = safe_ratio(ml_df['baños'].to_numpy(), dormitorios)
         
         # Seleccionar features relevantes
         feature_columns = [
@@ -57,55 +101,113 @@ class InvestmentModel:
             'ratio_precio_dormitorios', 'ratio_m2_dormitorios', 'ratio_baño_dormitorios'
         ]
         
-        # Agregar columnas dummy de barrios y operaciones
-        barrio_cols = [col for col in ml_df.columns if col.startswith('barrio_')]
-        operacion_cols = [col for col in ml_df.columns if col.startswith('operacion_')]
+        # Encoding disperso de variables categóricas con categorías fijas
+        barrio_dummies = pd.get_dummies(
+            pd.Categorical(ml_df['barrio'], categories=BARRIOS_MONTEVIDEO),
+            prefix='barrio', sparse=True, dtype=np.uint8
+        )
+        operacion_dummies = pd.get_dummies(
+            pd.Categorical(ml_df['tipo_operacion'], categories=['venta', 'alquiler']),
+            prefix='operacion', sparse=True, dtype=np.uint8
+        )
+        
+        X = sparse.hstack([
+            sparse.csr_matrix(ml_df[feature_columns].to_numpy(dtype=np.float32)),
+            barrio_dummies.sparse.to_coo(),
+            operacion_dummies.sparse.to_coo()
+        ], format='csr')
         
-        self.feature_columns = feature_columns + barrio_cols + operacion_cols
+        self.feature_columns = (
+            feature_columns + list(barrio_dummies.columns) + list(operacion_dummies.columns)
+        )
         
-        return ml_df
+        return ml_df, X
+    
+    def prepare_hist_features(self, df=None):
+        """
+        Prepara la matriz densa para HistGradientBoosting
+        
+        Mantiene los faltantes como NaN y los barrios/operaciones como códigos
+        enteros (categorical_features), sin medianas ni one-hot.
+        Por defecto usa self.df; df permite preparar otras filas (predicción).
+        """
+        df = self.df if df is None else df
+        dormitorios = df['dormitorios'].to_numpy(dtype=np.float32)
+        banos = df['baños'].to_numpy(dtype=np.float32)
+        
+        barrio_codes = pd.Categorical(df['barrio'], categories=BARRIOS_MONTEVIDEO).codes
+        operacion_codes = pd.Categorical(df['tipo_operacion'], categories=['venta', 'alquiler']).codes
+        
+        columns = {
+            'metros_cuadrados': df['metros_cuadrados'].to_numpy(dtype=np.float32),
+            'dormitorios': dormitorios,
+            'baños': banos,
+            # Mismas ratios que prepare_features (0 para monoambientes)
+            'ratio_precio_dormitorios': safe_ratio(df['precio'].to_numpy(dtype=np.float32), dormitorios),
+            'ratio_m2_dormitorios': safe_ratio(df['metros_cuadrados'].to_numpy(dtype=np.float32), dormitorios),
+            'ratio_baño_dormitorios': safe_ratio(banos, dormitorios),
+            # Código -1 (categoría desconocida) pasa a NaN
+            'barrio': np.where(barrio_codes < 0, np.nan, barrio_codes).astype(np.float32),
+            'tipo_operacion': np.where(operacion_codes < 0, np.nan, operacion_codes).astype(np.float32)
+        }
+        
+        self.hist_feature_columns = list(columns)
+        categorical_mask = [col in ('barrio', 'tipo_operacion') for col in columns]
+        
+        return np.column_stack(list(columns.values())), categorical_mask
     
     def train_model(self):
         """Entrena el modelo de machine learning"""
         print("Preparando datos para entrenamiento...")
-        ml_df = self.prepare_features()
+        ml_df, X = self.prepare_features()
+        X_hist, categorical_mask = self.prepare_hist_features()
         
-        # Separar features y target
-        X = ml_df[self.feature_columns]
+        # Separar target
         y = ml_df[self.target_column]
         
-        # División train/test
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE
+        # División train/test (mismas filas para ambas matrices)
+        train_idx, test_idx = train_test_split(
+            np.arange(len(y)), test_size=TEST_SIZE, random_state=RANDOM_STATE
         )
+        X_train, X_test = X[train_idx], X[test_idx]
+        X_hist_train, X_hist_test = X_hist[train_idx], X_hist[test_idx]
+        y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
         
         # Escalar features
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
         
-        # Entrenar múltiples modelos
+        # Entrenar múltiples modelos (n_jobs=1 en RF para no anidar paralelismo)
         models = {
-            'RandomForest': RandomForestRegressor(n_estimators=100, random_state=RANDOM_STATE),
-            'GradientBoosting': GradientBoostingRegressor(random_state=RANDOM_STATE),
+            'HistGradientBoosting': HistGradientBoostingRegressor(
+                max_iter=200, learning_rate=0.05, max_bins=255,
+                categorical_features=categorical_mask,
+                early_stopping=True, random_state=RANDOM_STATE
+            ),
+            'RandomForest': RandomForestRegressor(n_estimators=100, n_jobs=1, random_state=RANDOM_STATE),
             'LinearRegression': LinearRegression()
         }
         
-        best_model = None
-        best_score = float('-inf')
+        # Matriz de entrada de cada modelo (solo la regresión lineal usa features escaladas)
+        model_inputs = {
+            'HistGradientBoosting': (X_hist_train, X_hist_test),
+            'RandomForest': (X_train, X_test),
+            'LinearRegression': (X_train_scaled, X_test_scaled)
+        }
         
         print("Entrenando modelos...")
-        for name, model in models.items():
-            if name == 'LinearRegression':
-                model.fit(X_train_scaled, y_train)
-                y_pred = model.predict(X_test_scaled)
-            else:
-                model.fit(X_train, y_train)
-                y_pred = model.predict(X_test)
-            
-            r2 = r2_score(y_test, y_pred)
-            mae = mean_absolute_error(y_test, y_pred)
-            rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-            
+        results = Parallel(n_jobs=-1, backend='loky')(
+            delayed(fit_and_score)(
+                name, model,
+                model_inputs[name][0], y_train,
+                model_inputs[name][1], y_test
+            )
+            for name, model in models.items()
+        )
+        
+        best_score = float('-inf')
+        
+        for name, model, r2, mae, rmse in results:
             print(f"{name}:")
             print(f"  R² Score: {r2:.4f}")
             print(f"  MAE: {mae:.2f}")
@@ -114,17 +216,38 @@ class InvestmentModel:
             
             if r2 > best_score:
                 best_score = r2
-                best_model = model
                 self.model = model
                 self.best_model_name = name
         
+        # Usar todos los núcleos al predecir con el bosque ganador
+        if self.best_model_name == 'RandomForest':
+            self.model.set_params(n_jobs=-1)
+        
+        if self.best_model_name == 'HistGradientBoosting':
+            # Barrio y operación como códigos enteros; HistGB no expone
+            # feature_importances_, se estima por permutación sobre el test
+            self.feature_columns = self.hist_feature_columns
+            self.feature_encoding = 'codes'
+            self.feature_importances = permutation_importance(
+                self.model, X_hist_test, y_test,
+                n_repeats=5, random_state=RANDOM_STATE, n_jobs=-1
+            ).importances_mean
+        else:
+            self.feature_encoding = 'one_hot'
+            self.feature_importances = getattr(self.model, 'feature_importances_', None)
+        
         print(f"Mejor modelo: {self.best_model_name} (R² = {best_score:.4f})")
         
-        # Guardar modelo
+        # Guardar modelo (las features junto con su encoding y el modelo ganador)
         os.makedirs('models', exist_ok=True)
         joblib.dump(self.model, 'models/investment_model.pkl')
         joblib.dump(self.scaler, 'models/scaler.pkl')
-        joblib.dump(self.feature_columns, 'models/feature_columns.pkl')
+        joblib.dump({
+            'feature_columns': self.feature_columns,
+            'feature_encoding': self.feature_encoding,
+            'best_model_name': self.best_model_name,
+            'feature_importances': self.feature_importances
+        }, 'models/feature_columns.pkl')
         
         return best_score
     
@@ -136,13 +259,16 @@ class InvestmentModel:
         # Convertir a DataFrame
         df = pd.DataFrame([property_data])
         
-        # Aplicar el mismo procesamiento
-        # (Este método necesitaría el mismo preprocesamiento que en train)
+        # Aplicar el mismo encoding con el que se entrenó el modelo ganador
+        if self.feature_encoding == 'codes':
+            X, _ = self.prepare_hist_features(df)
+        else:
+            _, X = self.prepare_features(df)
         
         if self.best_model_name == 'LinearRegression':
-            prediction = self.model.predict(self.scaler.transform(df[self.feature_columns]))
+            prediction = self.model.predict(self.scaler.transform(X))
         else:
-            prediction = self.model.predict(df[self.feature_columns])
+            prediction = self.model.predict(X)
         
         return prediction[0]
     
@@ -151,7 +277,17 @@ class InvestmentModel:
         try:
             self.model = joblib.load('models/investment_model.pkl')
             self.scaler = joblib.load('models/scaler.pkl')
-            self.feature_columns = joblib.load('models/feature_columns.pkl')
+            info = joblib.load('models/feature_columns.pkl')
+            if isinstance(info, dict):
+                self.feature_columns = info['feature_columns']
+                self.feature_encoding = info['feature_encoding']
+                self.best_model_name = info['best_model_name']
+                self.feature_importances = info['feature_importances']
+            else:
+                # Formato anterior: solo la lista de features one-hot
+                self.feature_columns = info
+                self.feature_encoding = 'one_hot'
+                self.feature_importances = getattr(self.model, 'feature_importances_', None)
             print("Modelo cargado exitosamente")
             return True
         except FileNotFoundError:
@@ -160,10 +296,10 @@ class InvestmentModel:
     
     def analyze_feature_importance(self):
         """Analiza importancia de características"""
-        if hasattr(self.model, 'feature_importances_'):
+        if self.feature_importances is not None:
             importance_df = pd.DataFrame({
                 'feature': self.feature_columns,
-                'importance': self.model.feature_importances_
+                'importance': self.feature_importances
             }).sort_values('importance', ascending=False)
             
             print("=== IMPORTANCIA DE CARACTERÍSTICAS ===")
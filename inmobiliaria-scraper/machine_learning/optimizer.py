@@ -5,41 +5,139 @@ Encuentra las mejores oportunidades de inversión
 
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
+from numba import njit
+import sqlite3
 import sys
 import os
 
 # Agregar el directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import *
+from scraping.database import get_conn
+
+# Columnas que necesita el scoring
+PROPERTY_COLUMNS = [
+    'barrio', 'tipo_operacion', 'precio', 'precio_por_m2',
+    'metros_cuadrados', 'dormitorios', 'baños'
+]
+
+# Presupuestos con scores base cacheados (cada entrada guarda una copia filtrada)
+SCORE_CACHE_SIZE = 2
+
+def column_range(values):
+    """Mínimo y 1/(máx - mín) de una columna (0 si todos los valores son iguales)"""
+    lo, hi = np.nanmin(values), np.nanmax(values)
+    return lo, (1.0 / (hi - lo) if hi > lo else 0.0)
+
+@njit(fastmath=True, cache=True)
+def combine_scores(roi, ppm2, tam, lo, inv_range, weights, out):
+    """
+    Normaliza (min-max) y pondera las tres métricas en una sola pasada
+    
+    El precio/m2 se invierte: menor precio/m2 = mejor score. Sin
+    parallel=True: se llama desde los hilos de varias sesiones de Streamlit
+    y la capa de hilos 'workqueue' de Numba no admite llamadas concurrentes.
+    """
+    for i in range(roi.shape[0]):
+        out[i] = (
+            weights[0] * (roi[i] - lo[0]) * inv_range[0] +
+            weights[1] * (1.0 - (ppm2[i] - lo[1]) * inv_range[1]) +
+            weights[2] * (tam[i] - lo[2]) * inv_range[2]
+        )
 
 class InvestmentOptimizer:
     def __init__(self):
         self.properties_df = None
         self.roi_df = None
         self.investment_scores = None
+        self.score_cache = {}
+        
+    def load_data(self, budget_min=None, budget_max=None):
+        """
+        Carga propiedades en venta y ROI por barrio
+        
+        El filtro de operación y presupuesto se aplica en origen (SQLite),
+        con los mismos rangos válidos que usa DataProcessor.clean_data.
+        Si la base no está disponible se usan los datos procesados.
+        """
+        precio_min = MIN_PRICE if budget_min is None else max(budget_min, MIN_PRICE)
+        precio_max = MAX_PRICE if budget_max is None else min(budget_max, MAX_PRICE)
         
-    def load_data(self):
-        """Carga datos procesados"""
         try:
-            self.properties_df = pd.read_csv('data/processed/propiedades_limpias.csv')
-            self.roi_df = pd.read_csv('data/processed/roi_por_barrio.csv')
+            self.roi_df = pd.read_parquet(ROI_PATH)
+            self.properties_df = self.query_properties(precio_min, precio_max)
+            if self.properties_df is None:
+                self.properties_df = self.read_processed_properties(precio_min, precio_max)
+            self.properties_df = self.properties_df.astype(NUMERIC_DTYPES)
+            self.score_cache = {}
             print(f"Datos cargados: {len(self.properties_df)} propiedades")
             return True
         except FileNotFoundError:
             print("Error: Ejecute primero el procesador de datos")
             return False
     
-    def calculate_investment_score(self, budget_min=50000, budget_max=300000, 
-                                 risk_tolerance='medium'):
+    def query_properties(self, precio_min, precio_max):
         """
-        Calcula un score de inversión para cada propiedad
+        Lee de SQLite solo las propiedades en venta dentro del rango de precio
         
-        Parámetros:
-        - budget_min: Presupuesto mínimo
-        - budget_max: Presupuesto máximo  
-        - risk_tolerance: 'low', 'medium', 'high'
+        Devuelve None si la base no existe o todavía no tiene la tabla
+        de propiedades (por ejemplo, si se procesó antes de scrapear).
+        """
+        if not os.path.exists(DATABASE_PATH):
+            return None
+        
+        try:
+            df = pd.read_sql_query(
+                """
+                SELECT barrio, tipo_operacion, precio,
+                       CAST(precio AS REAL) / metros_cuadrados AS precio_por_m2,
+                       metros_cuadrados, dormitorios, baños
+                FROM propiedades
+                WHERE tipo_operacion = 'venta'
+                  AND precio BETWEEN ? AND ?
+                  AND metros_cuadrados BETWEEN ? AND ?
+                  AND barrio IS NOT NULL
+                """,
+                get_conn(),
+                params=(precio_min, precio_max, MIN_M2, MAX_M2)
+            )
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            # pandas envuelve los errores de ejecución en DatabaseError
+            print(f"No se pudo leer la base ({e}), se usan los datos procesados")
+            return None
+        
+        # Misma normalización de barrios que el procesador
+        df['barrio'] = df['barrio'].str.strip().str.title()
+        return df
+    
+    def read_processed_properties(self, precio_min, precio_max):
+        """Lee los datos procesados en Parquet con solo las columnas necesarias"""
+        # pyarrow aplica el filtro al leer
+        return pd.read_parquet(
+            PROCESSED_PARQUET_PATH,
+            columns=PROPERTY_COLUMNS,
+            filters=[
+                ('tipo_operacion', '==', 'venta'),
+                ('precio', '>=', precio_min),
+                ('precio', '<=', precio_max)
+            ]
+        )
+    
+    def prepare_scores(self, budget_min, budget_max):
+        """
+        Filtra por presupuesto, agrega ROI y calcula los rangos de normalización
+        
+        No depende de la tolerancia al riesgo, así que se cachea por
+        presupuesto: cambiar solo el perfil de riesgo reutiliza este paso.
+        Solo se guardan los SCORE_CACHE_SIZE presupuestos más recientes.
+        Devuelve None si no hay propiedades en el rango.
         """
+        key = (budget_min, budget_max)
+        if key in self.score_cache:
+            # Reinsertar para marcarlo como el más reciente
+            self.score_cache[key] = self.score_cache.pop(key)
+            return self.score_cache[key]
+        
         # Filtrar propiedades en venta dentro del presupuesto
         venta_props = self.properties_df[
             (self.properties_df['tipo_operacion'] == 'venta') &
@@ -48,36 +146,54 @@ class InvestmentOptimizer:
         ].copy()
         
         if len(venta_props) == 0:
-            print("No hay propiedades en el rango de presupuesto especificado")
-            return None
+            return self.cache_scores(key, None)
         
         # Agregar datos de ROI por barrio
-        venta_props = venta_props.merge(
-            self.roi_df[['barrio', 'roi_anual_porcentaje']], 
-            on='barrio', 
-            how='left'
-        )
+        # (con barrio categórico map devuelve una categoría: se pasa a float)
+        roi_map = dict(zip(self.roi_df['barrio'], self.roi_df['roi_anual_porcentaje']))
+        venta_props['roi_anual_porcentaje'] = venta_props['barrio'].map(roi_map).astype(np.float32)
         
         # Rellenar ROI faltante con la mediana
         venta_props['roi_anual_porcentaje'] = venta_props['roi_anual_porcentaje'].fillna(
             venta_props['roi_anual_porcentaje'].median()
         )
         
-        # Crear features para scoring
-        scaler = MinMaxScaler()
+        # Métricas y rangos para la normalización min-max (0-1, donde 1 es mejor)
+        roi = venta_props['roi_anual_porcentaje'].to_numpy(dtype=np.float32)
+        ppm2 = venta_props['precio_por_m2'].to_numpy(dtype=np.float32)
+        tam = venta_props['metros_cuadrados'].to_numpy(dtype=np.float32)
+        
+        ranges = [column_range(values) for values in (roi, ppm2, tam)]
+        lo = np.array([r[0] for r in ranges], dtype=np.float64)
+        inv_range = np.array([r[1] for r in ranges], dtype=np.float64)
+        
+        return self.cache_scores(key, (venta_props, roi, ppm2, tam, lo, inv_range))
+    
+    def cache_scores(self, key, value):
+        """Guarda los scores base de un presupuesto descartando los más antiguos"""
+        self.score_cache[key] = value
+        while len(self.score_cache) > SCORE_CACHE_SIZE:
+            # Los dict conservan el orden de inserción: el primero es el más antiguo
+            del self.score_cache[next(iter(self.score_cache))]
+        return value
+    
+    def calculate_investment_score(self, budget_min=50000, budget_max=300000, 
+                                 risk_tolerance='medium'):
+        """
+        Calcula un score de inversión para cada propiedad
         
-        # Normalizar métricas (0-1, donde 1 es mejor)
-        venta_props['score_roi'] = scaler.fit_transform(
-            venta_props[['roi_anual_porcentaje']]
-        ).flatten()
+        Parámetros:
+        - budget_min: Presupuesto mínimo
+        - budget_max: Presupuesto máximo  
+        - risk_tolerance: 'low', 'medium', 'high'
+        """
+        base = self.prepare_scores(budget_min, budget_max)
         
-        venta_props['score_precio_m2'] = 1 - scaler.fit_transform(
-            venta_props[['precio_por_m2']]
-        ).flatten()  # Invertido: menor precio/m2 = mejor
+        if base is None:
+            print("No hay propiedades en el rango de presupuesto especificado")
+            return None
         
-        venta_props['score_tamaño'] = scaler.fit_transform(
-            venta_props[['metros_cuadrados']]
-        ).flatten()
+        venta_props, roi, ppm2, tam, lo, inv_range = base
         
         # Calcular score basado en tolerancia al riesgo
         if risk_tolerance == 'low':
@@ -90,15 +206,13 @@ class InvestmentOptimizer:
             # Priorizar ROI alto
             weights = {'roi': 0.6, 'precio_m2': 0.2, 'tamaño': 0.2}
         
-        venta_props['investment_score'] = (
-            venta_props['score_roi'] * weights['roi'] +
-            venta_props['score_precio_m2'] * weights['precio_m2'] +
-            venta_props['score_tamaño'] * weights['tamaño']
-        )
-        
-        # Ordenar por score
-        venta_props = venta_props.sort_values('investment_score', ascending=False)
+        # Normalizar y ponderar en un solo kernel
+        weight_vec = np.array([weights['roi'], weights['precio_m2'], weights['tamaño']])
+        scores = np.empty(len(venta_props), dtype=np.float64)
+        combine_scores(roi, ppm2, tam, lo, inv_range, weight_vec, scores)
         
+        # Sin ordenar: get_top_opportunities selecciona solo las N mejores
+        venta_props = venta_props.assign(investment_score=scores)
         self.investment_scores = venta_props
         return venta_props
     
@@ -108,7 +222,15 @@ class InvestmentOptimizer:
             print("Primero calcule los scores de inversión")
             return None
         
-        top_props = self.investment_scores.head(n)[
+        # Selección parcial O(N) y orden completo solo de las N elegidas
+        scores = self.investment_scores['investment_score'].to_numpy()
+        if n < len(scores):
+            idx = np.argpartition(-scores, n - 1)[:n]
+        else:
+            idx = np.arange(len(scores))
+        idx = idx[np.argsort(-scores[idx], kind='stable')]
+        
+        top_props = self.investment_scores.iloc[idx][
             ['barrio', 'precio', 'metros_cuadrados', 'precio_por_m2', 
              'roi_anual_porcentaje', 'investment_score', 'dormitorios', 'baños']
         ].round(2)
@@ -120,7 +242,7 @@ class InvestmentOptimizer:
         if self.investment_scores is None:
             return None
         
-        neighborhood_analysis = self.investment_scores.groupby('barrio').agg({
+        neighborhood_analysis = self.investment_scores.groupby('barrio', observed=True).agg({
             'investment_score': ['mean', 'max', 'count'],
             'precio': ['mean', 'min', 'max'],
             'roi_anual_porcentaje': 'mean',
@@ -155,11 +277,18 @@ class InvestmentOptimizer:
         if opportunities is None:
             return None
         
-        # Filtrar por ubicación si se especifica
+        # Filtrar por ubicación si se especifica (nombres normalizados como en el procesador)
         if location_preference:
-            opportunities = opportunities[
-                opportunities['barrio'].str.contains(location_preference, case=False, na=False)
-            ]
+            location_preference = location_preference.strip().title()
+            if location_preference not in BARRIOS_SET:
+                print(f"Aviso: {location_preference} no está entre los barrios analizados")
+            opportunities = opportunities[opportunities['barrio'] == location_preference]
+            
+            if len(opportunities) == 0:
+                print(f"No hay propiedades en {location_preference} dentro del presupuesto")
+                return None
+            
+            self.investment_scores = opportunities
         
         # Top oportunidades
         top_10 = self.get_top_opportunities(10)
@@ -191,7 +320,7 @@ class InvestmentOptimizer:
 if __name__ == "__main__":
     optimizer = InvestmentOptimizer()
     
-    if optimizer.load_data():
+    if optimizer.load_data(budget_min=80000, budget_max=200000):
         # Ejemplo de análisis
         results = optimizer.get_investment_recommendation(
             budget_min=80000,
@@ -32,13 +32,10 @@ def run_scraping():
     
     scraper = InfocasasScraper()
     try:
-        # Scraper propiedades en venta
-        print("📊 Scrapeando propiedades en venta...")
-        scraper.scrape_properties("venta", 20)  # Reducido para pruebas
-        
-        # Scraper propiedades en alquiler
-        print("🏠 Scrapeando propiedades en alquiler...")
-        scraper.scrape_properties("alquiler", 20)
+        # Scraper propiedades en venta y alquiler en paralelo
+        print("📊 Scrapeando propiedades en venta y alquiler...")
+        for operation_type in scraper.scrape_operations(("venta", "alquiler"), 20):  # Reducido para pruebas
+            print(f"✔️ {operation_type} completado")
         
         # Guardar datos
         scraper.save_to_database()
@@ -87,16 +84,16 @@ def run_investment_analysis():
     print("\n💰 Analizando oportunidades de inversión...")
     
     try:
-        optimizer = InvestmentOptimizer()
-        if not optimizer.load_data():
-            print("❌ No se encontraron datos procesados")
-            return
-        
         # Solicitar parámetros al usuario
         print("\nConfiguración de búsqueda:")
         budget_min = int(input("Presupuesto mínimo (USD): ") or "80000")
         budget_max = int(input("Presupuesto máximo (USD): ") or "200000")
         
+        optimizer = InvestmentOptimizer()
+        if not optimizer.load_data(budget_min, budget_max):
+            print("❌ No se encontraron datos procesados")
+            return
+        
         print("\nTolerancia al riesgo:")
         print("1. Baja (conservador)")
         print("2. Media (balanceado)")
@@ -137,21 +134,29 @@ def show_statistics():
     
     try:
         # Cargar datos si existen
-        import pandas as pd
-        import sqlite3
         from config.settings import DATABASE_PATH
+        from scraping.database import get_conn
         
         if os.path.exists(DATABASE_PATH):
-            conn = sqlite3.connect(DATABASE_PATH)
-            df = pd.read_sql_query("SELECT * FROM propiedades", conn)
-            conn.close()
+            # Todas las estadísticas en una sola consulta agregada
+            total, venta, alquiler, barrios, precio_min, precio_max, ultima = get_conn().execute(
+                """
+                SELECT COUNT(*),
+                       COALESCE(SUM(tipo_operacion = 'venta'), 0),
+                       COALESCE(SUM(tipo_operacion = 'alquiler'), 0),
+                       COUNT(DISTINCT barrio),
+                       MIN(precio), MAX(precio), MAX(fecha_scraping)
+                FROM propiedades
+                """
+            ).fetchone()
             
-            print(f"Total propiedades en base de datos: {len(df)}")
-            print(f"Propiedades en venta: {len(df[df['tipo_operacion'] == 'venta'])}")
-            print(f"Propiedades en alquiler: {len(df[df['tipo_operacion'] == 'alquiler'])}")
-            print(f"Barrios únicos: {df['barrio'].nunique()}")
-            print(f"Rango de precios: USD {df['precio'].min():,.0f} - {df['precio'].max():,.0f}")
-            print(f"Última actualización: {df['fecha_scraping'].max()}")
+            print(f"Total propiedades en base de datos: {total}")
+            print(f"Propiedades en venta: {venta}")
+            print(f"Propiedades en alquiler: {alquiler}")
+            print(f"Barrios únicos: {barrios}")
+            if precio_min is not None:
+                print(f"Rango de precios: USD {precio_min:,.0f} - {precio_max:,.0f}")
+            print(f"Última actualización: {ultima}")
         else:
             print("No hay datos disponibles. Ejecute primero el scraping.")
             
@@ -5,103 +5,197 @@ Limpia y prepara los datos para análisis y ML
 
 import pandas as pd
 import numpy as np
-import sqlite3
+import functools
+import json
 import sys
 import os
 
 # Agregar el directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import *
+from scraping.database import get_conn
+
+# Categorías ordenadas: se guardan como códigos enteros y no como texto
+CATEGORIA_PRECIO_DTYPE = pd.CategoricalDtype(['Económica', 'Media', 'Alta', 'Premium'], ordered=True)
+CATEGORIA_TAMAÑO_DTYPE = pd.CategoricalDtype(['Pequeña', 'Mediana', 'Grande', 'Extra Grande'], ordered=True)
+
+# Límites superiores (inclusivos) de cada categoría salvo la última
+PRECIO_BINS = np.array([100000, 200000, 300000], dtype=np.float32)
+TAMAÑO_BINS = np.array([50, 80, 120], dtype=np.float32)
+
+# Tipos de las columnas leídas de SQLite (texto repetido como categoría)
+RAW_DTYPES = {
+    'barrio': 'category',
+    'tipo_operacion': 'category',
+    **{col: NUMERIC_DTYPES[col] for col in ('precio', 'metros_cuadrados', 'dormitorios', 'baños')}
+}
+
+@functools.lru_cache(maxsize=4)
+def load_cleaned(path, mtime):
+    """
+    Lee el Parquet de datos limpios, una vez por versión del archivo
+    
+    mtime es parte de la clave: si el archivo se reescribe se vuelve a leer.
+    El DataFrame devuelto es compartido, no debe modificarse en el lugar.
+    """
+    return pd.read_parquet(path)
 
 class DataProcessor:
     def __init__(self):
         self.df = None
+        self.barrio_stats = None
+        self.fingerprint = None
+        self.is_clean = False
         
     def load_data(self):
-        """Carga datos desde la base de datos"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        self.df = pd.read_sql_query("SELECT * FROM propiedades", conn)
-        conn.close()
-        print(f"Cargados {len(self.df)} registros")
+        """
+        Carga datos desde la base de datos
+        
+        Si la base no cambió desde el último procesamiento (misma cantidad de
+        filas y misma fecha de scraping más reciente) y los rangos válidos de
+        precio y m² son los mismos, se reutilizan los datos limpios guardados
+        en Parquet y clean_data no vuelve a ejecutarse.
+        """
+        conn = get_conn()
+        count, max_fecha = conn.execute(
+            "SELECT COUNT(*), MAX(fecha_scraping) FROM propiedades"
+        ).fetchone()
+        # Los rangos se filtran en la consulta: si cambian, el Parquet no sirve
+        self.fingerprint = {
+            'count': count,
+            'max_fecha_scraping': max_fecha,
+            'precio_range': [MIN_PRICE, MAX_PRICE],
+            'm2_range': [MIN_M2, MAX_M2]
+        }
+        self.barrio_stats = None
+        
+        if self.cached_fingerprint() == self.fingerprint:
+            # Copia superficial: columnas nuevas no alteran la versión cacheada
+            self.df = load_cleaned(
+                PROCESSED_PARQUET_PATH, os.path.getmtime(PROCESSED_PARQUET_PATH)
+            ).copy(deep=False)
+            self.is_clean = True
+            print(f"Cargados {len(self.df)} registros limpios desde {PROCESSED_PARQUET_PATH}")
+            return
+        
+        # SQLite descarta nulos y valores fuera de rango antes de llegar a pandas
+        self.df = pd.read_sql_query(
+            """
+            SELECT precio, metros_cuadrados, dormitorios, baños, barrio,
+                   tipo_operacion, fecha_scraping
+            FROM propiedades
+            WHERE precio BETWEEN ? AND ?
+              AND metros_cuadrados BETWEEN ? AND ?
+              AND barrio IS NOT NULL
+            """,
+            conn,
+            params=(MIN_PRICE, MAX_PRICE, MIN_M2, MAX_M2)
+        ).astype(RAW_DTYPES)
+        self.is_clean = False
+        print(f"Cargados {len(self.df)} registros ({count - len(self.df)} descartados por datos faltantes o fuera de rango)")
+    
+    def cached_fingerprint(self):
+        """Huella de la base con la que se generó el Parquet procesado (o None)"""
+        if not (os.path.exists(PROCESSED_PARQUET_PATH) and os.path.exists(PROCESSED_FINGERPRINT_PATH)):
+            return None
+        with open(PROCESSED_FINGERPRINT_PATH, encoding='utf-8') as f:
+            return json.load(f)
         
     def clean_data(self):
         """Limpia y procesa los datos"""
-        print("Iniciando limpieza de datos...")
+        if self.is_clean:
+            print("Datos ya procesados, se omite la limpieza")
+            return
         
-        # Remover registros con datos faltantes críticos
-        initial_count = len(self.df)
-        self.df = self.df.dropna(subset=['precio', 'metros_cuadrados', 'barrio'])
-        print(f"Removidos {initial_count - len(self.df)} registros con datos faltantes")
+        print("Iniciando limpieza de datos...")
         
-        # Filtrar por rangos válidos
-        self.df = self.df[
-            (self.df['precio'] >= MIN_PRICE) & 
-            (self.df['precio'] <= MAX_PRICE) &
-            (self.df['metros_cuadrados'] >= MIN_M2) &
-            (self.df['metros_cuadrados'] <= MAX_M2)
-        ]
+        # Los registros con datos faltantes o fuera de rango ya se filtraron
+        # en la consulta de load_data
         
         # Calcular precio por m2 si no existe
-        self.df['precio_por_m2'] = self.df['precio'] / self.df['metros_cuadrados']
+        self.df['precio_por_m2'] = self.df['precio'].to_numpy() / self.df['metros_cuadrados'].to_numpy()
         
-        # Normalizar nombres de barrios
-        self.df['barrio'] = self.df['barrio'].str.strip().str.title()
+        # Reducir numéricos a float32 (dormitorios y baños tienen nulos, no
+        # admiten enteros sin nulos); agrupaciones y ROI mueven la mitad de bytes
+        self.df = self.df.astype(NUMERIC_DTYPES)
         
-        # Crear variables categóricas
-        self.df['categoria_precio'] = pd.cut(
-            self.df['precio'], 
-            bins=[0, 100000, 200000, 300000, float('inf')],
-            labels=['Económica', 'Media', 'Alta', 'Premium']
+        # Normalizar nombres de barrios sobre las categorías (una vez por
+        # barrio distinto) y reasignar los códigos
+        barrios = self.df['barrio'].cat
+        normalized, inverse = np.unique(
+            barrios.categories.str.strip().str.title(), return_inverse=True
+        )
+        self.df['barrio'] = pd.Categorical.from_codes(
+            inverse[barrios.codes.to_numpy()], categories=normalized
         )
         
-        self.df['categoria_tamaño'] = pd.cut(
-            self.df['metros_cuadrados'],
-            bins=[0, 50, 80, 120, float('inf')],
-            labels=['Pequeña', 'Mediana', 'Grande', 'Extra Grande']
+        # Crear variables categóricas: búsqueda binaria sobre los límites
+        # (intervalos cerrados a derecha, igual que pd.cut)
+        self.df['categoria_precio'] = pd.Categorical.from_codes(
+            np.searchsorted(PRECIO_BINS, self.df['precio'].to_numpy()),
+            dtype=CATEGORIA_PRECIO_DTYPE
         )
         
+        self.df['categoria_tamaño'] = pd.Categorical.from_codes(
+            np.searchsorted(TAMAÑO_BINS, self.df['metros_cuadrados'].to_numpy()),
+            dtype=CATEGORIA_TAMAÑO_DTYPE
+        )
+        
+        self.barrio_stats = None
+        self.is_clean = True
         print(f"Datos limpios: {len(self.df)} registros")
         
+    def calculate_barrio_stats(self):
+        """
+        Agrega todas las métricas por barrio y tipo de operación en una pasada
+        
+        El resultado se reutiliza para las métricas de mercado y el ROI.
+        """
+        if self.barrio_stats is None:
+            self.barrio_stats = self.df.groupby(['barrio', 'tipo_operacion'], observed=True).agg({
+                'precio': ['mean', 'median', 'std', 'count'],
+                'precio_por_m2': ['mean', 'median', 'std'],
+                'metros_cuadrados': ['mean', 'median']
+            })
+        return self.barrio_stats
+    
+    def operation_stats(self, operation_type):
+        """Métricas por barrio de un tipo de operación (vacío si no hay datos)"""
+        stats = self.calculate_barrio_stats()
+        if operation_type not in stats.index.get_level_values('tipo_operacion'):
+            return stats.iloc[0:0].droplevel('tipo_operacion')
+        return stats.xs(operation_type, level='tipo_operacion')
+    
     def calculate_market_metrics(self):
         """Calcula métricas del mercado por barrio"""
         # Métricas por barrio para venta
-        venta_metrics = self.df[self.df['tipo_operacion'] == 'venta'].groupby('barrio').agg({
-            'precio': ['mean', 'median', 'std', 'count'],
-            'precio_por_m2': ['mean', 'median', 'std'],
-            'metros_cuadrados': ['mean', 'median']
-        }).round(2)
+        venta_metrics = self.operation_stats('venta').round(2)
         
         # Métricas por barrio para alquiler
-        alquiler_metrics = self.df[self.df['tipo_operacion'] == 'alquiler'].groupby('barrio').agg({
-            'precio': ['mean', 'median', 'std', 'count'],
-            'precio_por_m2': ['mean', 'median', 'std'],
-            'metros_cuadrados': ['mean', 'median']
-        }).round(2)
+        alquiler_metrics = self.operation_stats('alquiler').round(2)
         
         return venta_metrics, alquiler_metrics
     
     def calculate_roi_potential(self):
         """Calcula potencial de ROI por barrio"""
         # Obtener precios promedio de venta y alquiler por barrio
-        venta_avg = self.df[self.df['tipo_operacion'] == 'venta'].groupby('barrio')['precio'].mean()
-        alquiler_avg = self.df[self.df['tipo_operacion'] == 'alquiler'].groupby('barrio')['precio'].mean()
+        venta_avg = self.operation_stats('venta')[('precio', 'mean')]
+        alquiler_avg = self.operation_stats('alquiler')[('precio', 'mean')]
         
         # Calcular ROI anual (alquiler mensual * 12 / precio de venta)
-        roi_data = []
-        for barrio in venta_avg.index:
-            if barrio in alquiler_avg.index:
-                precio_venta = venta_avg[barrio]
-                precio_alquiler_mensual = alquiler_avg[barrio]
-                roi_anual = (precio_alquiler_mensual * 12 / precio_venta) * 100
-                
-                roi_data.append({
-                    'barrio': barrio,
-                    'precio_venta_promedio': precio_venta,
-                    'precio_alquiler_mensual_promedio': precio_alquiler_mensual,
-                    'roi_anual_porcentaje': roi_anual
-                })
-        
-        roi_df = pd.DataFrame(roi_data).sort_values('roi_anual_porcentaje', ascending=False)
+        # solo para barrios con ambos tipos de operación
+        roi_df = (
+            pd.concat([
+                venta_avg.rename('precio_venta_promedio'),
+                alquiler_avg.rename('precio_alquiler_mensual_promedio')
+            ], axis=1, join='inner')
+            .assign(roi_anual_porcentaje=lambda d: (
+                d['precio_alquiler_mensual_promedio'] * 12 / d['precio_venta_promedio']
+            ) * 100)
+            .sort_values('roi_anual_porcentaje', ascending=False)
+            .rename_axis('barrio')
+            .reset_index()
+        )
         return roi_df
     
     def prepare_ml_features(self):
@@ -109,8 +203,11 @@ class DataProcessor:
         # Crear DataFrame para ML
         ml_df = self.df.copy()
         
-        # Encoding de variables categóricas
-        ml_df = pd.get_dummies(ml_df, columns=['barrio', 'tipo_operacion'], prefix=['barrio', 'operacion'])
+        # Encoding de variables categóricas (one-hot disperso en uint8)
+        ml_df = pd.get_dummies(
+            ml_df, columns=['barrio', 'tipo_operacion'], prefix=['barrio', 'operacion'],
+            sparse=True, dtype=np.uint8
+        )
         
         # Rellenar valores faltantes
         ml_df['dormitorios'] = ml_df['dormitorios'].fillna(ml_df['dormitorios'].median())
@@ -127,17 +224,23 @@ class DataProcessor:
         # Crear directorio si no existe
         os.makedirs('data/processed', exist_ok=True)
         
-        # Guardar CSV
-        self.df.to_csv('data/processed/propiedades_limpias.csv', index=False)
+        # Guardar en Parquet (lo leen el optimizador y el modelo)
+        self.df.to_parquet(PROCESSED_PARQUET_PATH, engine='pyarrow', compression='zstd', index=False)
+        if self.fingerprint is not None:
+            with open(PROCESSED_FINGERPRINT_PATH, 'w', encoding='utf-8') as f:
+                json.dump(self.fingerprint, f)
         
         # Calcular y guardar métricas
         venta_metrics, alquiler_metrics = self.calculate_market_metrics()
-        venta_metrics.to_csv('data/processed/metricas_venta_por_barrio.csv')
-        alquiler_metrics.to_csv('data/processed/metricas_alquiler_por_barrio.csv')
+        for metrics, path in ((venta_metrics, VENTA_METRICS_PATH), (alquiler_metrics, ALQUILER_METRICS_PATH)):
+            # Parquet requiere nombres de columna de texto: ('precio', 'mean') -> 'precio_mean'
+            metrics.columns = ['_'.join(col) for col in metrics.columns]
+            metrics.to_parquet(path, engine='pyarrow', compression='zstd')
         
-        # Calcular y guardar ROI
+        # Calcular y guardar ROI (más un CSV comprimido para consultarlo a mano)
         roi_df = self.calculate_roi_potential()
-        roi_df.to_csv('data/processed/roi_por_barrio.csv', index=False)
+        roi_df.to_parquet(ROI_PATH, engine='pyarrow', compression='zstd', index=False)
+        roi_df.to_csv(ROI_CSV_PATH, index=False, compression='gzip')
         
         print("Datos procesados guardados en data/processed/")
         
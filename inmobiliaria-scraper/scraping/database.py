@@ -0,0 +1,60 @@
+"""
+Conexión a la base de datos SQLite
+Una conexión por hilo (CLI) o por sesión (Streamlit), configurada una sola vez
+"""
+
+import sqlite3
+import threading
+import sys
+import os
+
+# Agregar el directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.settings import *
+
+# Conexiones abiertas por cada hilo (uso por defecto, p. ej. desde main.py)
+thread_connections = threading.local()
+
+# Almacén alternativo de conexiones (mapping); la app usa st.session_state
+# porque Streamlit abre un hilo nuevo en cada rerun, no uno por sesión
+connection_store = None
+
+def set_connection_store(store):
+    """Guarda las conexiones en store (p. ej. st.session_state) en lugar de por hilo"""
+    global connection_store
+    connection_store = store
+
+def open_conn(db_path):
+    """Abre una conexión a db_path con los PRAGMAs para cargas y lecturas masivas"""
+    # check_same_thread=False: la conexión de una sesión se usa desde el hilo
+    # de cada rerun, de a uno por vez
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # ~64 MB de caché de páginas
+    conn.execute("PRAGMA mmap_size=268435456")  # leer el archivo vía mmap (256 MB)
+    return conn
+
+def get_conn(db_path=DATABASE_PATH):
+    """
+    Conexión a db_path del hilo actual (o de la sesión, si hay connection_store)
+
+    Cada hilo o sesión tiene su propia conexión: las transacciones de uno no
+    se mezclan con las de otro y, en modo WAL, los lectores solo ven datos
+    confirmados. Está en modo autocommit (isolation_level=None): quien
+    escribe abre y cierra su transacción con BEGIN/COMMIT explícitos.
+    No debe cerrarse.
+    """
+    store = connection_store
+    if store is None:
+        store = getattr(thread_connections, 'by_path', None)
+        if store is None:
+            store = thread_connections.by_path = {}
+
+    key = f"sqlite_conn:{db_path}"
+    conn = store.get(key)
+    if conn is None:
+        conn = open_conn(db_path)
+        store[key] = conn
+    return conn
@@ -8,66 +8,128 @@ from bs4 import BeautifulSoup
 import pandas as pd
 import time
 import re
+import threading
+from itertools import islice
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-import sqlite3
 import os
 import sys
 
 # Agregar el directorio padre al path para importar config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.settings import *
+from scraping.database import get_conn
+
+# Columnas de la tabla propiedades (mismo orden que generaba pandas)
+PROPERTY_COLUMNS = [
+    'precio', 'metros_cuadrados', 'dormitorios', 'baños', 'barrio',
+    'precio_por_m2', 'url', 'fecha_scraping', 'tipo_operacion'
+]
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS propiedades (
+    precio INTEGER,
+    metros_cuadrados INTEGER,
+    dormitorios INTEGER,
+    baños INTEGER,
+    barrio TEXT,
+    precio_por_m2 REAL,
+    url TEXT UNIQUE,
+    fecha_scraping TIMESTAMP,
+    tipo_operacion TEXT
+)
+"""
+
+# Las propiedades ya guardadas (misma URL) se ignoran
+INSERT_SQL = (
+    f"INSERT OR IGNORE INTO propiedades ({', '.join(PROPERTY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(PROPERTY_COLUMNS))})"
+)
+
+# Patrones de precio y detalles de cada propiedad (compilados una sola vez)
+PRICE_CLEAN_RE = re.compile(r'[U$S,.\s]')
+M2_RE = re.compile(r'(\d+)\s*m²')
+ROOMS_RE = re.compile(r'(\d+)\s*dorm')
+BATHS_RE = re.compile(r'(\d+)\s*baño')
 
 class InfocasasScraper:
     def __init__(self):
-        self.setup_driver()
-        self.data = []
+        self.driver_path = ChromeDriverManager().install()
+        self.data_lock = threading.Lock()
         
-    def setup_driver(self):
-        """Configura el driver de Selenium"""
+        # Una sola regex para todos los barrios (los nombres largos primero)
+        barrios = sorted(BARRIOS_MONTEVIDEO, key=len, reverse=True)
+        self.barrio_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(b) for b in barrios) + r")\b", re.IGNORECASE
+        )
+        self.barrio_canonical = {b.lower(): b for b in BARRIOS_MONTEVIDEO}
+        
+        # Un navegador por hilo del pool, creado al primer uso
+        self.thread_drivers = threading.local()
+        self.drivers = []
+        
+        # Datos por columna (una lista por campo, en el orden de la tabla)
+        self.data = {col: [] for col in PROPERTY_COLUMNS}
+        
+    def create_driver(self):
+        """Crea un driver de Selenium headless"""
         chrome_options = Options()
         chrome_options.add_argument("--headless")  # Ejecutar sin ventana
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
         
-        self.driver = webdriver.Chrome(
-            service=webdriver.chrome.service.Service(ChromeDriverManager().install()),
+        return webdriver.Chrome(
+            service=webdriver.chrome.service.Service(self.driver_path),
             options=chrome_options
         )
+    
+    def get_thread_driver(self):
+        """Driver del hilo actual (cada worker del pool usa su propio navegador)"""
+        driver = getattr(self.thread_drivers, 'driver', None)
+        if driver is None:
+            driver = self.create_driver()
+            self.thread_drivers.driver = driver
+            with self.data_lock:
+                self.drivers.append(driver)
+        return driver
         
     def extract_property_data(self, property_element):
-        """Extrae datos de un elemento de propiedad"""
+        """Extrae datos de un elemento de propiedad (nodo de BeautifulSoup)"""
         try:
             # Precio
-            price_element = property_element.find_element(By.CSS_SELECTOR, ".price")
-            price = self.clean_price(price_element.text)
+            price_element = property_element.select_one(".price")
+            price = self.clean_price(price_element.get_text(" ", strip=True))
             
             # Detalles de la propiedad
-            details = property_element.find_element(By.CSS_SELECTOR, ".property-details")
+            details = property_element.select_one(".property-details").get_text(" ", strip=True)
             
             # Metros cuadrados
-            m2_match = re.search(r'(\d+)\s*m²', details.text)
+            m2_match = M2_RE.search(details)
             m2 = int(m2_match.group(1)) if m2_match else None
             
             # Dormitorios
-            rooms_match = re.search(r'(\d+)\s*dorm', details.text)
+            rooms_match = ROOMS_RE.search(details)
             rooms = int(rooms_match.group(1)) if rooms_match else None
             
             # Baños
-            baths_match = re.search(r'(\d+)\s*baño', details.text)
+            baths_match = BATHS_RE.search(details)
             baths = int(baths_match.group(1)) if baths_match else None
             
             # Barrio
-            location_element = property_element.find_element(By.CSS_SELECTOR, ".location")
-            neighborhood = self.clean_neighborhood(location_element.text)
+            location_element = property_element.select_one(".location")
+            neighborhood = self.clean_neighborhood(location_element.get_text(" ", strip=True))
             
-            # URL de la propiedad
-            link_element = property_element.find_element(By.CSS_SELECTOR, "a")
-            property_url = link_element.get_attribute("href")
+            # URL de la propiedad (absoluta, como la devolvía Selenium)
+            # (None si no hay enlace: urljoin con None devolvería BASE_URL)
+            link_element = property_element.select_one("a")
+            href = link_element.get("href") if link_element else None
+            property_url = urljoin(BASE_URL, href) if href else None
             
             return {
                 'precio': price,
@@ -77,7 +139,7 @@ class InfocasasScraper:
                 'barrio': neighborhood,
                 'precio_por_m2': price / m2 if price and m2 else None,
                 'url': property_url,
-                'fecha_scraping': pd.Timestamp.now()
+                'fecha_scraping': pd.Timestamp.now().isoformat(sep=' ')
             }
             
         except Exception as e:
@@ -87,7 +149,7 @@ class InfocasasScraper:
     def clean_price(self, price_text):
         """Limpia y convierte el precio a número"""
         # Remover símbolos y convertir a número
-        price_clean = re.sub(r'[U$S,.\s]', '', price_text)
+        price_clean = PRICE_CLEAN_RE.sub('', price_text)
         try:
             return int(price_clean)
         except:
@@ -95,74 +157,178 @@ class InfocasasScraper:
     
     def clean_neighborhood(self, location_text):
         """Extrae el barrio del texto de ubicación"""
-        # Implementar lógica para extraer barrio específico
-        for barrio in BARRIOS_MONTEVIDEO:
-            if barrio.lower() in location_text.lower():
-                return barrio
+        match = self.barrio_pattern.search(location_text)
+        if match:
+            return self.barrio_canonical[match.group(1).lower()]
         return location_text.strip()
     
+    def fetch_page(self, page_url):
+        """Carga una página en el navegador del hilo y devuelve su HTML (o None)"""
+        print(f"Scrapeando página: {page_url}")
+        driver = self.get_thread_driver()
+        
+        try:
+            driver.get(page_url)
+            time.sleep(DELAY_BETWEEN_REQUESTS)
+            
+            # Esperar a que carguen las propiedades
+            WebDriverWait(driver, TIMEOUT).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ".property-item"))
+            )
+            return driver.page_source
+            
+        except Exception as e:
+            print(f"Error en página {page_url}: {e}")
+            return None
+    
+    def parse_page(self, html, operation_type):
+        """Agrega a self.data las propiedades del HTML de una página de resultados"""
+        # Un solo parseo del HTML en lugar de una llamada a Chromedriver por campo
+        soup = BeautifulSoup(html, "lxml")
+        
+        for prop in soup.select(".property-item"):
+            property_data = self.extract_property_data(prop)
+            if property_data:
+                property_data['tipo_operacion'] = operation_type
+                for col in PROPERTY_COLUMNS:
+                    self.data[col].append(property_data[col])
+    
+    def property_count(self):
+        """Cantidad de propiedades scrapeadas"""
+        return len(self.data['url'])
+    
+    def page_urls(self, operation_type, max_pages):
+        """URLs de las páginas de resultados de un tipo de operación"""
+        url = VENTA_URL if operation_type == "venta" else ALQUILER_URL
+        return [f"{url}?pagina={page}" for page in range(1, max_pages + 1)]
+    
     def scrape_properties(self, operation_type="venta", max_pages=10):
         """Scrape propiedades por tipo de operación"""
-        url = VENTA_URL if operation_type == "venta" else ALQUILER_URL
+        for _ in self.scrape_operations((operation_type,), max_pages):
+            pass
+    
+    def scrape_operations(self, operation_types=("venta", "alquiler"), max_pages=10):
+        """
+        Scrapea las páginas de varios tipos de operación con un pool de navegadores
         
-        for page in range(1, max_pages + 1):
-            page_url = f"{url}?pagina={page}"
-            print(f"Scrapeando página {page}: {page_url}")
-            
-            try:
-                self.driver.get(page_url)
-                time.sleep(DELAY_BETWEEN_REQUESTS)
-                
-                # Esperar a que carguen las propiedades
-                WebDriverWait(self.driver, TIMEOUT).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".property-item"))
-                )
-                
-                properties = self.driver.find_elements(By.CSS_SELECTOR, ".property-item")
-                
-                for prop in properties:
-                    property_data = self.extract_property_data(prop)
-                    if property_data:
-                        property_data['tipo_operacion'] = operation_type
-                        self.data.append(property_data)
-                
-                print(f"Página {page} completada. Total propiedades: {len(self.data)}")
+        Hasta SCRAPER_WORKERS navegadores headless descargan páginas en paralelo
+        (cada uno respeta DELAY_BETWEEN_REQUESTS); el HTML se parsea en el hilo
+        que llama. Es un generador: devuelve cada tipo de operación cuando
+        terminan todas sus páginas, para poder reportar progreso.
+        """
+        pending = {op: max_pages for op in operation_types}
+        
+        try:
+            with ThreadPoolExecutor(max_workers=SCRAPER_WORKERS) as executor:
+                futures = {
+                    executor.submit(self.fetch_page, page_url): op
+                    for op in operation_types
+                    for page_url in self.page_urls(op, max_pages)
+                }
                 
-            except Exception as e:
-                print(f"Error en página {page}: {e}")
-                continue
+                for future in as_completed(futures):
+                    operation_type = futures[future]
+                    html = future.result()
+                    if html:
+                        self.parse_page(html, operation_type)
+                        print(f"Página de {operation_type} completada. Total propiedades: {self.property_count()}")
+                    
+                    pending[operation_type] -= 1
+                    if pending[operation_type] == 0:
+                        yield operation_type
+        finally:
+            self.close()
     
     def save_to_database(self):
         """Guarda los datos en SQLite"""
-        df = pd.DataFrame(self.data)
+        self.deduplicate_data()
+        
+        # Filas como tuplas en el orden de la tabla, sin DataFrame intermedio
+        rows = zip(*(self.data[col] for col in PROPERTY_COLUMNS))
         
         # Crear directorio data si no existe
         os.makedirs('data', exist_ok=True)
         
-        # Conectar a la base de datos
-        conn = sqlite3.connect(DATABASE_PATH)
+        # Conexión compartida en autocommit: la transacción se abre a mano
+        conn = get_conn()
         
-        # Guardar datos
-        df.to_sql('propiedades', conn, if_exists='append', index=False)
+        # Guardar datos con executemany en lotes, dentro de una sola transacción
+        conn.execute("BEGIN")
+        try:
+            conn.execute(CREATE_TABLE_SQL)
+            self.ensure_unique_url(conn)
+            while batch := list(islice(rows, INSERT_BATCH_SIZE)):
+                conn.executemany(INSERT_SQL, batch)
+            
+            # Índice para las agregaciones por barrio/operación del dashboard
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_barrio_op ON propiedades(barrio, tipo_operacion)"
+            )
+            # Índice parcial para la búsqueda por presupuesto del optimizador
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_venta_precio ON propiedades(precio) "
+                "WHERE tipo_operacion = 'venta'"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
         
-        conn.close()
         print(f"Datos guardados en {DATABASE_PATH}")
     
+    def deduplicate_data(self):
+        """Descarta propiedades sin URL o repetidas (se conserva la primera)"""
+        seen = set()
+        keep = []
+        for i, url in enumerate(self.data['url']):
+            if url and url not in seen:
+                seen.add(url)
+                keep.append(i)
+        
+        removed = self.property_count() - len(keep)
+        if removed:
+            print(f"Descartadas {removed} propiedades repetidas o sin URL")
+            self.data = {col: [values[i] for i in keep] for col, values in self.data.items()}
+    
+    def ensure_unique_url(self, conn):
+        """
+        Agrega la restricción de URL única a bases creadas antes de tenerla
+        
+        Elimina primero las filas repetidas (conserva la más antigua) para que
+        el índice único pueda crearse.
+        """
+        has_unique = conn.execute(
+            "SELECT COUNT(*) FROM pragma_index_list('propiedades') WHERE \"unique\""
+        ).fetchone()[0]
+        if has_unique:
+            return
+        
+        deleted = conn.execute(
+            """
+            DELETE FROM propiedades
+            WHERE url IS NOT NULL
+              AND rowid NOT IN (SELECT MIN(rowid) FROM propiedades GROUP BY url)
+            """
+        ).rowcount
+        if deleted:
+            print(f"Eliminadas {deleted} filas con URL repetida")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_url ON propiedades(url)")
+    
     def close(self):
-        """Cierra el driver"""
-        self.driver.quit()
+        """Cierra los navegadores abiertos"""
+        with self.data_lock:
+            drivers, self.drivers = self.drivers, []
+        for driver in drivers:
+            driver.quit()
 
 if __name__ == "__main__":
     scraper = InfocasasScraper()
     
     try:
-        # Scraper propiedades en venta
-        print("Iniciando scraping de propiedades en venta...")
-        scraper.scrape_properties("venta", MAX_PAGES_TO_SCRAPE)
-        
-        # Scraper propiedades en alquiler
-        print("Iniciando scraping de propiedades en alquiler...")
-        scraper.scrape_properties("alquiler", MAX_PAGES_TO_SCRAPE)
+        # Scraper propiedades en venta y alquiler en paralelo
+        print("Iniciando scraping de propiedades en venta y alquiler...")
+        for operation_type in scraper.scrape_operations(("venta", "alquiler"), MAX_PAGES_TO_SCRAPE):
+            print(f"Scraping de {operation_type} completado")
         
         # Guardar datos
         scraper.save_to_database()